@@ -1,6 +1,7 @@
 from esma_data_py.src.esma_data_loader import EsmaDataLoader
+from esma_data_py.src.utils import SharedDataset
 
-__all__ = ['EsmaDataLoader']
+__all__ = ['EsmaDataLoader', 'SharedDataset']
 
 if __name__ == '__main__':
     print(EsmaDataLoader())
\ No newline at end of file
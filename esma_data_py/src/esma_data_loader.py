@@ -4,6 +4,7 @@ import requests
 import tempfile
 import xml.etree.ElementTree as ET
 from requests.models import Response
+import numpy as np
 import pandas as pd
 import os
 from bs4 import BeautifulSoup
@@ -81,11 +82,59 @@ class EsmaDataLoader:
                           save_locally: bool = False,
                           update: bool = False):
 
+        delivery_df, _ = self.__load_latest_files(file_type=file_type, vcap=vcap, isin=isin, cfi=cfi, eqt=eqt,
+                                                  save_locally=save_locally, update=update)
+        return delivery_df
+
+
+    def share_latest_files(self,
+                           file_type: str = 'Full',
+                           vcap: bool = False,
+                           isin: Optional[List[str]] = [],
+                           cfi: str = 'E',
+                           eqt=True,
+                           save_locally: bool = False,
+                           update: bool = False,
+                           name: Optional[str] = None):
+
+        df, mifid_file_list = self.__load_latest_files(file_type=file_type, vcap=vcap, isin=isin, cfi=cfi, eqt=eqt,
+                                                       save_locally=save_locally, update=update)
+        if df is None:
+            return
+
+        if not name:
+            # The publication date keeps each drop in its own file, so open handles are never overwritten
+            name = '_'.join([self.__utils._hash("".join([str(arg) for arg in [file_type, vcap, isin, cfi, eqt]]
+                                                        + ['share_latest_files'])),
+                             str(mifid_file_list.date.max())])
+
+        self.__logger.info(f'Publishing {len(df)} records as a shared dataset')
+        handle = self.__utils.publish_shared_df(df, name=name)
+        self.__logger.info(f'Shared dataset available at {handle.path}')
+        return handle
+
+
+    def clear_shared_datasets(self):
+
+        removed = self.__utils.clear_shared_dfs()
+        self.__logger.info(f'{removed} shared datasets removed')
+        return removed
+
+
+    def __load_latest_files(self,
+                            file_type: str,
+                            vcap: bool,
+                            isin: Optional[List[str]],
+                            cfi: str,
+                            eqt: bool,
+                            save_locally: bool,
+                            update: bool):
+
         try:
             cfi = u.Cfi(cfi).value
         except Exception as e:
             self.__logger.error(f'Error: {e}')
-            return
+            return None, None
 
         if vcap:
             mifid_file_list = self.__get_latest_vcap_files()
@@ -114,54 +163,91 @@ class EsmaDataLoader:
             list_dwndl_dfs.append(self.__utils.download_and_parse_file(url, save=save_locally, update=update))
             
         self.__logger.info('Process done!')
-        return pd.concat(list_dwndl_dfs)
+        return pd.concat(list_dwndl_dfs), mifid_file_list
 
 
     
-    def load_ssr_exempted_shares(self, today: bool = True):
+    def load_ssr_exempted_shares(self,
+                                 today: bool = True,
+                                 as_of=None,
+                                 save_locally: bool = False,
+                                 update: bool = False):
+        """Load the SSR exempted shares, optionally resolved as of one or several dates.
+
+        With save_locally=True the register is kept in ~/esma_data_py/ssr and only records
+        modified since the last sync are downloaded, update=True forces a full download.
+        Records withdrawn from the register are only noticed through the record count of each
+        country, a country whose count differs from the local one is downloaded again in full.
+        as_of takes a date, a list of dates, or a (start, end) tuple which returns validity periods.
+        """
 
-        list_countries = [ "AT", "BE", "BG", "CY", "CZ", "DE", "DK", "EE", "ES", "FI", 
-                           "FR", "GR", "HR", "HU", "IE", "IT", "LT", "LU", "LV", "MT", 
-                           "NL", "PL", "PT", "RO", "SE", "SI", "SK", "NO", "GB"]
-        
-        list_dfs = []
-        
-        self.__logger.info(f'Requesting SSR Exempted Shares')
-        with tqdm(total=len(list_countries), position=0, leave=True) as pbar:
-            for country in list_countries:
-                
-                pbar.set_description(f"Processing request for {country}")
-                pbar.update(1)
-                
-                country_query = self.query_url.ssr.format(country=country)
-                request = requests.get(country_query)
-                if request.status_code == 200:
-                    json_request = request.json()["response"]["docs"]
-                    df = pd.DataFrame(json_request)
-                    list_dfs.append(df)
-                else:
-                    self.warning(f'Request failed, status code {request.status_code} for country {country}')
-        
-        delivery_df = pd.concat(list_dfs) 
+        if save_locally:
+            delivery_df = self.sync_ssr_exempted_shares(update=update)
+        else:
+            self.__logger.info(f'Requesting all SSR Exempted Shares, flag the parameter save_locally=True to sync them incrementally')
+            delivery_df, _ = self.__get_ssr_exempted_shares()
 
-        if not today: 
+        if as_of is None and not today:
             self.__logger.info(f'Process done!')
             return delivery_df
 
-        self.__logger.info(f'Filtering for today\'s date')
-        today_date = datetime.today().strftime("%Y-%m-%d")
-        
-        filtered_data = delivery_df.query('shs_modificationBDate > @today_date and shs_exemptionStartDate <= @today_date')
+        if as_of is None:
+            as_of = datetime.today().strftime("%Y-%m-%d")
+
+        self.__logger.info(f'Filtering for as of date(s) {as_of}')
+        final_data = u.SsrStore.as_of(delivery_df, as_of)
+
+        if np.ndim(as_of) == 0:
+            final_data = final_data.drop(columns='as_of_date')
 
-        duplicates = filtered_data[filtered_data.duplicated(subset='shs_isin', keep=False)]
-        duplicates = duplicates[duplicates['shs_modificationDateStr'] <= today_date]
-        
-        non_duplicates = filtered_data[~filtered_data['shs_isin'].isin(duplicates['shs_isin'])]
-        
-        final_data = pd.concat([duplicates, non_duplicates]).reset_index(drop=True)
         self.__logger.info(f'Process done!')
-        
-        return final_data       
+        return final_data
+
+
+    def sync_ssr_exempted_shares(self, update: bool = False):
+
+        store = u.SsrStore()
+        stored_df = store.load()
+        modification_dates = {} if update else store.last_modification_dates(stored_df)
+
+        self.__logger.info(f'Requesting SSR Exempted Shares modified since the last sync')
+        new_df, failed_countries = self.__get_ssr_exempted_shares(modification_dates=modification_dates)
+        self.__logger.info(f'{len(new_df)} new or modified records')
+
+        # Countries downloaded in full replace their stored records, failed ones keep them
+        full_countries = [country for country in u.SsrStore.countries
+                          if country not in modification_dates and country not in failed_countries]
+        delivery_df = store.merge(stored_df, new_df, replace_countries=full_countries)
+
+        incremental_countries = [country for country in modification_dates if country not in failed_countries]
+        if incremental_countries:
+            delivery_df, reconcile_failed_countries = self.__reconcile_ssr_exempted_shares(store, delivery_df,
+                                                                                           incremental_countries)
+            failed_countries += reconcile_failed_countries
+
+        if failed_countries:
+            self.__logger.warning(f'Previously stored records kept for {", ".join(failed_countries)}, '
+                                  f'they will be requested again on the next sync')
+
+        return delivery_df
+
+
+    def __reconcile_ssr_exempted_shares(self, store: u.SsrStore, delivery_df: pd.DataFrame, countries: List[str]):
+
+        found_counts = self.__count_ssr_exempted_shares(countries)
+        stored_counts = delivery_df.groupby('shs_countryCode').size()
+
+        # Withdrawn records are never returned as modified, a register count different from the stored one reveals them
+        mismatched_countries = [country for country, count in found_counts.items()
+                                if count != stored_counts.get(country, 0)]
+        if not mismatched_countries:
+            return delivery_df, []
+
+        self.__logger.info(f'Record count differs for {", ".join(mismatched_countries)}, requesting them in full')
+        full_df, failed_countries = self.__get_ssr_exempted_shares(countries=mismatched_countries)
+        full_countries = [country for country in mismatched_countries if country not in failed_countries]
+
+        return store.merge(delivery_df, full_df, replace_countries=full_countries), failed_countries
 
 
     def __get_files_single_df_mifid(self, dataset: str):
@@ -221,6 +307,60 @@ class EsmaDataLoader:
             mifid_file_list = mifid_file_list.loc[lambda x: x.instrument_type == "Non-Equity Instruments"]
 
         return mifid_file_list.loc[lambda x: x.date == max_date]
+
+    def __get_ssr_exempted_shares(self, modification_dates: Optional[dict] = None, countries: Optional[List[str]] = None):
+
+        modification_dates = modification_dates or {}
+        countries = countries or u.SsrStore.countries
+        list_dfs = []
+        failed_countries = []
+
+        with tqdm(total=len(countries), position=0, leave=True) as pbar:
+            for country in countries:
+
+                pbar.set_description(f"Processing request for {country}")
+                pbar.update(1)
+
+                if modification_date_from := modification_dates.get(country):
+                    country_query = self.query_url.ssr_modified.format(country=country, rows=self.query_url.ssr_rows,
+                                                                       modification_date_from=modification_date_from)
+                else:
+                    country_query = self.query_url.ssr.format(country=country, rows=self.query_url.ssr_rows)
+                request = requests.get(country_query)
+                if request.status_code != 200:
+                    self.__logger.warning(f'Request failed, status code {request.status_code} for country {country}')
+                    failed_countries.append(country)
+                    continue
+
+                response = request.json()["response"]
+                if response.get("numFound", 0) > len(response["docs"]):
+                    self.__logger.warning(f'Truncated response for country {country}, '
+                                          f'{len(response["docs"])} out of {response["numFound"]} records received')
+                    failed_countries.append(country)
+                    continue
+
+                df = pd.DataFrame(response["docs"])
+                if 'shs_countryCode' not in df.columns:
+                    df['shs_countryCode'] = country
+                list_dfs.append(df)
+
+        if not list_dfs:
+            return pd.DataFrame(), failed_countries
+
+        return pd.concat(list_dfs), failed_countries
+
+    def __count_ssr_exempted_shares(self, countries: List[str]):
+
+        found_counts = {}
+
+        for country in countries:
+            request = requests.get(self.query_url.ssr.format(country=country, rows=0))
+            if request.status_code != 200:
+                self.__logger.warning(f'Count request failed, status code {request.status_code} for country {country}')
+                continue
+            found_counts[country] = request.json()["response"]["numFound"]
+
+        return found_counts
      
 
 if __name__ == '__main__':
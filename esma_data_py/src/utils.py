@@ -6,15 +6,17 @@ import requests
 import tempfile
 import zipfile
 import warnings
+import numpy as np
 import pandas as pd
 import xml.etree.ElementTree as ET
 from collections import defaultdict, deque
 from bs4 import BeautifulSoup
 from tqdm import tqdm
-from typing import Any
+from typing import Any, List, Optional, Tuple
 from pathlib import Path
 from xml.etree.ElementTree import ElementTree
 from dataclasses import dataclass
+from datetime import datetime, timedelta
 from requests.models import Response
 from enum import Enum
 import logging
@@ -200,6 +202,52 @@ class Utils:
         delivery_df = df.applymap(lambda x: x[0] if isinstance(x, list) else x)
         return delivery_df
     
+    @staticmethod
+    def publish_shared_df(df: pd.DataFrame, name: str, folder: str = "shared") -> "SharedDataset":
+        """Write a DataFrame to an uncompressed Arrow IPC file and return a handle to it."""
+        pa, ipc = Utils._import_pyarrow()
+        shared_folder = Utils._create_folder(folder=folder)
+        file_name = os.path.join(shared_folder, name + ".arrow")
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+        # Write next to the target and swap it in, so readers never map a partial file
+        tmp_file_name = file_name + ".tmp" + str(os.getpid())
+        try:
+            with pa.OSFile(tmp_file_name, "wb") as sink:
+                with ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_file_name, file_name)
+        except Exception:
+            if os.path.exists(tmp_file_name):
+                os.remove(tmp_file_name)
+            raise
+
+        return SharedDataset(path=file_name, num_rows=table.num_rows, columns=tuple(table.column_names))
+
+    @staticmethod
+    def clear_shared_dfs(folder: str = "shared") -> int:
+        """Remove every dataset published in the shared folder, and partial writes left behind,
+        return the number of files removed."""
+        shared_folder = Utils._create_folder(folder=folder)
+        removed = 0
+        for pattern in ["*.arrow", "*.arrow.tmp*"]:
+            for file_name in shared_folder.glob(pattern):
+                file_name.unlink()
+                removed += 1
+        return removed
+
+    @staticmethod
+    def _import_pyarrow():
+        """Import pyarrow lazily, it is only needed for shared datasets."""
+        try:
+            import pyarrow as pa
+            import pyarrow.ipc as ipc
+        except ImportError as e:
+            raise ImportError("pyarrow is required for shared datasets, install it with: "
+                              "pip install esma_data_py[shared]") from e
+        return pa, ipc
+
     @staticmethod
     def set_logger(name: str):
         
@@ -235,11 +283,217 @@ class Cfi(Enum):
     S = 'S'
 
 
+@dataclass(frozen=True)
+class SharedDataset:
+    """Picklable handle on a dataset published with Utils.publish_shared_df."""
+
+    path: str
+    num_rows: int
+    columns: Tuple[str, ...]
+
+    def open(self) -> pd.DataFrame:
+        """Memory-map the published Arrow IPC file and expose it as an Arrow-backed DataFrame."""
+        pa, ipc = Utils._import_pyarrow()
+
+        # Arrow-backed dtypes keep the columns pointing at the mapped pages instead of copying them
+        table = ipc.open_file(pa.memory_map(self.path, "r")).read_all()
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    def remove(self):
+        """Delete the published file, processes which already opened it keep their mapping."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SsrStore:
+    """Local copy of the SSR exempted shares register, synced on shs_modificationDateStr."""
+
+    countries = ["AT", "BE", "BG", "CY", "CZ", "DE", "DK", "EE", "ES", "FI",
+                 "FR", "GR", "HR", "HU", "IE", "IT", "LT", "LU", "LV", "MT",
+                 "NL", "PL", "PT", "RO", "SE", "SI", "SK", "NO", "GB"]
+    key_columns = ['shs_isin', 'shs_exemptionStartDate', 'shs_modificationDateStr']
+
+    def __init__(self, folder: str = "ssr"):
+        self.path = os.path.join(Utils._create_folder(folder=folder), "ssr_exempted_shares.pkl")
+
+    def load(self) -> pd.DataFrame:
+        if not os.path.exists(self.path):
+            return pd.DataFrame()
+        try:
+            return pd.read_pickle(self.path)
+        except Exception as e:
+            warnings.warn(f"Error loading file: {self.path}\n{str(e)}")
+            os.remove(self.path)
+            return pd.DataFrame()
+
+    def last_modification_dates(self, df: pd.DataFrame, sync_date: Optional[str] = None) -> dict:
+        """Date to sync each country from, missing countries need a full download.
+
+        This is the latest modification date held locally, capped at sync_date (today by default)
+        since records can be modified in advance and would otherwise hide the ones published meanwhile.
+        """
+        if df.empty or not {'shs_countryCode', 'shs_modificationDateStr'}.issubset(df.columns):
+            return {}
+        sync_date = sync_date or datetime.today().strftime("%Y-%m-%d")
+        dates = df.dropna(subset=['shs_modificationDateStr']).groupby('shs_countryCode')['shs_modificationDateStr'].max()
+        return {country: min(str(date)[:10], sync_date) for country, date in dates.items()}
+
+    def merge(self, stored_df: pd.DataFrame, new_df: pd.DataFrame, replace_countries: List[str] = []) -> pd.DataFrame:
+        """Upsert freshly fetched records into the stored ones and persist the result.
+
+        The stored records of replace_countries are dropped first, new_df holds their full register.
+        """
+        if new_df.empty and not replace_countries:
+            return stored_df
+
+        if replace_countries and not stored_df.empty:
+            stored_df = stored_df[~stored_df['shs_countryCode'].isin(replace_countries)]
+
+        # The sync window is inclusive of the last known date, so overlapping records are replaced
+        subset = ['id'] if 'id' in new_df.columns else self.key_columns
+        merged_df = pd.concat([stored_df, new_df])
+        if not merged_df.empty:
+            merged_df = merged_df.drop_duplicates(subset=subset, keep='last')
+        merged_df = merged_df.reset_index(drop=True)
+        merged_df.to_pickle(self.path)
+        return merged_df
+
+    @staticmethod
+    def as_of(df: pd.DataFrame, dates) -> pd.DataFrame:
+        """Resolve the shares exempted on each of the given dates.
+
+        A record is valid on date D when shs_exemptionStartDate <= D < shs_modificationBDate;
+        when an ISIN has several valid records, those modified on or before D take precedence.
+        For a single date or a list of dates the result has one row per (as_of_date, record).
+        For a (start, end) tuple it has one row per period a record is valid within the range,
+        given by the valid_from and valid_to columns (both inclusive).
+        """
+        if isinstance(dates, tuple) and len(dates) == 2:
+            return SsrStore._valid_between(df, dates[0], dates[1])
+
+        # Work on ISO day strings, they sort chronologically and keep 9999-12-31 style open ends valid
+        as_of_dates = np.unique(pd.to_datetime(pd.Index(np.atleast_1d(dates))).strftime('%Y-%m-%d').to_numpy(dtype='U10'))
+
+        if df.empty:
+            return df.assign(as_of_date=pd.Series(dtype='datetime64[s]'))
+
+        record_idx, date_idx = SsrStore._valid_positions(df, as_of_dates)
+
+        valid_df = df.iloc[record_idx].reset_index(drop=True)
+        valid_df['as_of_date'] = SsrStore._to_timestamps(as_of_dates[date_idx])
+        return valid_df
+
+    @staticmethod
+    def _valid_positions(df: pd.DataFrame, as_of_dates: np.ndarray):
+        """Positions of the (record, date) pairs kept by as_of, for sorted ISO day strings."""
+        start, start_ok = SsrStore._to_days(df['shs_exemptionStartDate'])
+        end, end_ok = SsrStore._to_days(df['shs_modificationBDate'])
+        modification, modification_ok = SsrStore._to_days(df['shs_modificationDateStr'])
+
+        # Each record covers the sorted dates in [lo, hi), missing bounds never match
+        lo = np.searchsorted(as_of_dates, start, side='left')
+        hi = np.searchsorted(as_of_dates, end, side='left')
+        counts = np.where(start_ok & end_ok, np.clip(hi - lo, 0, None), 0)
+
+        record_idx = np.repeat(np.arange(len(df)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        date_idx = np.repeat(lo, counts) + offsets
+
+        # Records of a duplicated ISIN modified on or before D supersede the other ones,
+        # only ISINs with several records in the register can be concerned
+        several = df['shs_isin'].duplicated(keep=False).to_numpy()[record_idx]
+        isin_codes, isins = pd.factorize(df['shs_isin'], use_na_sentinel=False)
+        group, _ = pd.factorize(date_idx[several] * len(isins) + isin_codes[record_idx[several]])
+        group_size = np.bincount(group)
+
+        # D is at or after the modification date when its position is
+        modification_idx = np.searchsorted(as_of_dates, modification, side='left')
+        modified_before = modification_ok[record_idx[several]] & (date_idx[several] >= modification_idx[record_idx[several]])
+        superseding = (group_size[group] > 1) & modified_before
+        superseded = np.bincount(group, weights=superseding, minlength=len(group_size)) > 0
+
+        keep = np.ones(len(record_idx), dtype=bool)
+        keep[several] = superseding | ~superseded[group]
+        return record_idx[keep], date_idx[keep]
+
+    @staticmethod
+    def _valid_between(df: pd.DataFrame, start, end) -> pd.DataFrame:
+        """Validity periods of the records within [start, end], see as_of."""
+        start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+
+        if df.empty:
+            return df.assign(valid_from=pd.Series(dtype='datetime64[s]'), valid_to=pd.Series(dtype='datetime64[s]'))
+
+        record_start, start_ok = SsrStore._to_days(df['shs_exemptionStartDate'])
+        record_end, end_ok = SsrStore._to_days(df['shs_modificationBDate'])
+        modification, modification_ok = SsrStore._to_days(df['shs_modificationDateStr'])
+
+        # Clip every date to the range so they all convert to days, valid_to stays exclusive
+        range_start, range_end = start.strftime('%Y-%m-%d'), (end + timedelta(days=1)).strftime('%Y-%m-%d')
+        valid_from = SsrStore._clip_days(np.where(start_ok, record_start, range_start), range_start, range_end)
+        valid_to = SsrStore._clip_days(np.where(end_ok, record_end, range_start), range_start, range_end)
+        modified = SsrStore._clip_days(np.where(modification_ok, modification, range_end), range_start, range_end)
+        records = np.flatnonzero(start_ok & end_ok & (valid_from < valid_to))
+        valid_from, valid_to, modified = valid_from[records], valid_to[records], modified[records]
+
+        # The precedence between the records of an ISIN only changes on their start, end and modification days
+        isin_codes, _ = pd.factorize(df['shs_isin'].iloc[records], use_na_sentinel=False)
+        span = (end - start).days + 2
+        breakpoints = np.unique(np.concatenate([isin_codes * span + day for day in [valid_from, valid_to, modified]]))
+
+        # Each record is evaluated on the segments between the breakpoints of its ISIN within its validity
+        lo = np.searchsorted(breakpoints, isin_codes * span + valid_from)
+        hi = np.searchsorted(breakpoints, isin_codes * span + valid_to)
+        counts = hi - lo
+        record_idx = np.repeat(np.arange(len(records)), counts)
+        segment_idx = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        segment_start = breakpoints[segment_idx] % span
+        segment_end = breakpoints[segment_idx + 1] % span
+
+        group_size = np.bincount(segment_idx, minlength=len(breakpoints))
+        superseding = (group_size[segment_idx] > 1) & (segment_start >= modified[record_idx])
+        superseded = np.bincount(segment_idx, weights=superseding, minlength=len(breakpoints)) > 0
+        keep = superseding | ~superseded[segment_idx]
+        record_idx, segment_start, segment_end = record_idx[keep], segment_start[keep], segment_end[keep]
+
+        # Segments come out by record then by date, contiguous ones are merged into periods
+        new_period = np.ones(len(record_idx), dtype=bool)
+        new_period[1:] = (record_idx[1:] != record_idx[:-1]) | (segment_start[1:] != segment_end[:-1])
+        period_start = np.flatnonzero(new_period)
+        period_end = np.append(period_start[1:], len(record_idx))[:len(period_start)] - 1
+
+        valid_df = df.iloc[records[record_idx[period_start]]].reset_index(drop=True)
+        first_day = np.datetime64(range_start, 'D')
+        valid_df['valid_from'] = SsrStore._to_timestamps(first_day + segment_start[period_start])
+        valid_df['valid_to'] = SsrStore._to_timestamps(first_day + segment_end[period_end] - 1)
+        return valid_df
+
+    @staticmethod
+    def _clip_days(days: np.ndarray, first_day: str, last_day: str) -> np.ndarray:
+        """ISO day strings clipped to [first_day, last_day], as days since first_day."""
+        days = np.where(days < first_day, first_day, np.where(days > last_day, last_day, days))
+        return (days.astype('datetime64[D]') - np.datetime64(first_day, 'D')).astype(np.int64)
+
+    @staticmethod
+    def _to_timestamps(days: np.ndarray) -> pd.DatetimeIndex:
+        """Timestamps of days, at second resolution so dates after 2262 are kept."""
+        return pd.DatetimeIndex(np.asarray(days, dtype='datetime64[D]').astype('datetime64[s]'))
+
+    @staticmethod
+    def _to_days(values: pd.Series):
+        """ISO day strings of the values, with a mask of the ones holding a date."""
+        days = values.astype(str).str[:10]
+        ok = days.str.fullmatch(r'\d{4}-\d{2}-\d{2}').fillna(False).to_numpy(dtype=bool)
+        return days.to_numpy(dtype='U10'), ok
+
+
 @dataclass
 class QueryUrl:
 
     ssr: str = ('https://registers.esma.europa.eu/solr/esma_registers_mifid_shsexs/select?'
-                'q=({{!parent%20which=%27type_s:parent%27}})&wt=json&indent=true&rows=150000&fq=(shs_countryCode:{country})')
+                'q=({{!parent%20which=%27type_s:parent%27}})&wt=json&indent=true&rows={rows}&fq=(shs_countryCode:{country})')
+    ssr_rows: int = 150000
+    ssr_modified: str = ssr + '&fq=(shs_modificationDateStr:[%22{modification_date_from}%22%20TO%20*])'
     mifid: str = ('https://registers.esma.europa.eu/solr/esma_registers_{db}_files/select?q=*'
                   '&fq={date_column}:%5B{creation_date_from}T00:00:00Z+TO+{creation_date_to}T23:59:59Z%5D&wt=xml&indent=true&start=0&rows={limit}')
     fca_firds: str =  ('https://api.data.fca.org.uk/fca_data_firds_files?q=((file_type:FULINS)'
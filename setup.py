@@ -37,6 +37,9 @@ setuptools.setup(
         "tqdm>=4.65.0",
         "requests>=2.31.0",
         ],
+    extras_require={
+        "shared": ["pyarrow>=12.0.0"],
+        },
     python_requires=">=3.7",
     test_suite="",
     tests_require=[]
@@ -0,0 +1,23 @@
+import os
+import tempfile
+import unittest
+
+from esma_data_py.src.utils import Utils
+
+
+class TemporaryHomeTestCase(unittest.TestCase):
+    """Run each test with HOME pointing to a temporary folder, so nothing is written under ~/esma_data_py."""
+
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.old_home = os.environ.get("HOME")
+        os.environ["HOME"] = self.home.name
+        Utils._create_folder.cache_clear()
+
+    def tearDown(self):
+        if self.old_home is None:
+            del os.environ["HOME"]
+        else:
+            os.environ["HOME"] = self.old_home
+        Utils._create_folder.cache_clear()
+        self.home.cleanup()
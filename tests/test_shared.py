@@ -0,0 +1,115 @@
+import os
+import pickle
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from esma_data_py import EsmaDataLoader, SharedDataset
+from esma_data_py.src.utils import Utils
+from temporary_home import TemporaryHomeTestCase
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+@unittest.skipIf(pa is None, "pyarrow is not installed")
+class SharedDatasetTests(TemporaryHomeTestCase):
+
+    def test_round_trip(self):
+        df = pd.DataFrame({"Id": pd.Series(["FR0000120271", np.nan, "DE0007164600"], dtype=object),
+                           "Mthdlgy": pd.Series(["SINT", "YEAR", np.nan], dtype=object),
+                           "Nb": [1.5, np.nan, 3.0]},
+                          index=[0, 0, 1])
+
+        handle = Utils.publish_shared_df(df, name="round_trip")
+        self.assertTrue(handle.path.startswith(self.home.name))
+        self.assertEqual(handle.num_rows, 3)
+        self.assertEqual(handle.columns, ("Id", "Mthdlgy", "Nb"))
+        hash(handle)
+
+        handle = pickle.loads(pickle.dumps(handle))
+        self.assertIsInstance(handle, SharedDataset)
+        shared_df = handle.open()
+
+        for column in df.columns:
+            self.assertEqual(shared_df[column].isna().tolist(), df[column].isna().tolist())
+            self.assertEqual(shared_df[column].dropna().tolist(), df[column].dropna().tolist())
+        self.assertEqual(shared_df.index.tolist(), [0, 1, 2])
+        for dtype in shared_df.dtypes:
+            self.assertIsInstance(dtype, pd.ArrowDtype)
+        self.assertTrue(pa.types.is_large_string(shared_df["Id"].dtype.pyarrow_dtype)
+                        or pa.types.is_string(shared_df["Id"].dtype.pyarrow_dtype))
+        self.assertTrue(pa.types.is_float64(shared_df["Nb"].dtype.pyarrow_dtype))
+
+    def test_open_is_zero_copy(self):
+        n = 1_000_000
+        df = pd.DataFrame({"a": np.arange(n, dtype="int64"), "b": np.random.rand(n)})
+        handle = Utils.publish_shared_df(df, name="zero_copy")
+
+        allocated = pa.total_allocated_bytes()
+        shared_df = handle.open()
+        self.assertLess(pa.total_allocated_bytes() - allocated, 1024 * 1024)
+        self.assertEqual(int(shared_df["a"].iloc[-1]), n - 1)
+
+    def test_remove(self):
+        first = Utils.publish_shared_df(pd.DataFrame({"a": [1]}), name="first")
+        Utils.publish_shared_df(pd.DataFrame({"a": [2]}), name="second")
+
+        first.remove()
+        self.assertFalse(os.path.exists(first.path))
+        self.assertEqual(Utils.clear_shared_dfs(), 1)
+        self.assertEqual(Utils.clear_shared_dfs(), 0)
+
+    def test_failed_write_leaves_no_partial_file(self):
+        with mock.patch("pyarrow.ipc.new_file", side_effect=OSError("No space left on device")):
+            with self.assertRaises(OSError):
+                Utils.publish_shared_df(pd.DataFrame({"a": [1]}), name="partial")
+
+        self.assertEqual(os.listdir(Utils._create_folder(folder="shared")), [])
+
+    def test_clear_removes_partial_writes(self):
+        shared_folder = Utils._create_folder(folder="shared")
+        (shared_folder / "partial.arrow.tmp1234").write_bytes(b"partial")
+
+        self.assertEqual(Utils.clear_shared_dfs(), 1)
+        self.assertEqual(os.listdir(shared_folder), [])
+
+
+@unittest.skipIf(pa is None, "pyarrow is not installed")
+class ShareLatestFilesTests(TemporaryHomeTestCase):
+
+    @staticmethod
+    def file_list(date):
+        return pd.DataFrame({"download_link": [f"http://fitrs.esma.europa.eu/fitrs/FULECR_{date}_E_1of1.zip"],
+                             "date": [date]})
+
+    def share(self, date):
+        parsed_df = pd.DataFrame({"Id": ["FR0000120271"], "Date": [date]})
+        with mock.patch.object(EsmaDataLoader, "_EsmaDataLoader__get_latest_fitrs_files",
+                               return_value=self.file_list(date)), \
+                mock.patch.object(Utils, "download_and_parse_file", return_value=parsed_df):
+            return EsmaDataLoader().share_latest_files()
+
+    def test_publication_dates_are_shared_separately(self):
+        first = self.share("20240622")
+        second = self.share("20240629")
+
+        self.assertNotEqual(first.path, second.path)
+        self.assertTrue(first.path.endswith("_20240622.arrow"))
+        self.assertEqual(first.open()["Date"].tolist(), ["20240622"])
+        self.assertEqual(second.open()["Date"].tolist(), ["20240629"])
+
+        self.assertEqual(EsmaDataLoader().clear_shared_datasets(), 2)
+        self.assertFalse(os.path.exists(first.path))
+        self.assertFalse(os.path.exists(second.path))
+
+    def test_invalid_cfi(self):
+        self.assertIsNone(EsmaDataLoader().share_latest_files(cfi="X"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+import os
+import unittest
+from unittest import mock
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from esma_data_py import EsmaDataLoader
+from esma_data_py.src.utils import SsrStore
+from temporary_home import TemporaryHomeTestCase
+
+
+def ssr_records():
+    return pd.DataFrame({'id': ['a1', 'a2', 'b1', 'b2', 'c1', 'd1', 'e1'],
+                         'shs_countryCode': ['FR', 'FR', 'DE', 'DE', 'FR', 'DE', 'FR'],
+                         'shs_isin': ['A', 'A', 'B', 'B', 'C', 'D', 'E'],
+                         'shs_exemptionStartDate': ['2024-01-01', '2024-03-01', '2024-01-01', '2024-01-01',
+                                                    '2024-02-01', np.nan, '2024-01-01T00:00:00Z'],
+                         'shs_modificationBDate': ['2025-01-01', '2025-01-01', '2024-06-01', '2024-06-01',
+                                                   '2024-02-10', '2025-01-01', np.nan],
+                         'shs_modificationDateStr': ['2024-01-01', '2024-02-15', '2024-05-01', '2024-05-02',
+                                                     '2024-02-01', '2024-01-01', '2024-01-01']})
+
+
+def old_as_of(delivery_df, today_date):
+    """Resolution previously done by load_ssr_exempted_shares for the current date."""
+    filtered_data = delivery_df.query('shs_modificationBDate > @today_date and shs_exemptionStartDate <= @today_date')
+    duplicates = filtered_data[filtered_data.duplicated(subset='shs_isin', keep=False)]
+    duplicates = duplicates[duplicates['shs_modificationDateStr'] <= today_date]
+    non_duplicates = filtered_data[~filtered_data['shs_isin'].isin(duplicates['shs_isin'])]
+    return pd.concat([duplicates, non_duplicates])
+
+
+class SsrAsOfTests(unittest.TestCase):
+
+    def test_same_as_previous_resolution(self):
+        df = ssr_records().iloc[:6]
+        for date in pd.date_range('2023-12-30', '2025-01-02').strftime('%Y-%m-%d'):
+            self.assertEqual(sorted(SsrStore.as_of(df, date)['id']), sorted(old_as_of(df, date)['id']), date)
+
+    def test_several_dates(self):
+        result = SsrStore.as_of(ssr_records(), ['2024-02-05', '2024-03-01'])
+        self.assertEqual(sorted(zip(result['as_of_date'].dt.strftime('%Y-%m-%d'), result['id'])),
+                         [('2024-02-05', 'a1'), ('2024-02-05', 'b1'), ('2024-02-05', 'b2'), ('2024-02-05', 'c1'),
+                          ('2024-03-01', 'a1'), ('2024-03-01', 'a2'), ('2024-03-01', 'b1'), ('2024-03-01', 'b2')])
+        self.assertEqual(list(result.columns), list(ssr_records().columns) + ['as_of_date'])
+
+    def test_date_range(self):
+        result = SsrStore.as_of(ssr_records(), ('2024-01-15', '2024-06-30'))
+        self.assertEqual([(row.id, row.valid_from.strftime('%Y-%m-%d'), row.valid_to.strftime('%Y-%m-%d'))
+                          for row in result.itertuples()],
+                         [('a1', '2024-01-15', '2024-06-30'), ('a2', '2024-03-01', '2024-06-30'),
+                          ('b1', '2024-01-15', '2024-05-31'),
+                          ('b2', '2024-01-15', '2024-04-30'), ('b2', '2024-05-02', '2024-05-31'),
+                          ('c1', '2024-02-01', '2024-02-09')])
+
+        daily = SsrStore.as_of(ssr_records(), pd.date_range('2024-01-15', '2024-06-30'))
+        expanded = [(row.id, day) for row in result.itertuples() for day in pd.date_range(row.valid_from, row.valid_to)]
+        self.assertEqual(sorted(expanded), sorted(zip(daily['id'], daily['as_of_date'])))
+
+    def test_modified_records_supersede(self):
+        result = SsrStore.as_of(ssr_records(), ['2024-03-01', '2024-05-01'])
+        by_date = result.groupby(result['as_of_date'].dt.strftime('%Y-%m-%d'))['id'].apply(sorted).to_dict()
+        # A: a1 and a2 are both valid and modified before, B: only b1 is modified on or before 2024-05-01
+        self.assertEqual(by_date['2024-03-01'], ['a1', 'a2', 'b1', 'b2'])
+        self.assertEqual(by_date['2024-05-01'], ['a1', 'a2', 'b1'])
+
+    def test_missing_bounds_never_match(self):
+        result = SsrStore.as_of(ssr_records(), ('2023-01-01', '2026-01-01'))
+        self.assertFalse(result['shs_isin'].isin(['D', 'E']).any())
+
+    def test_open_ended_exemption(self):
+        df = ssr_records().iloc[:1].assign(shs_modificationBDate='9999-12-31T00:00:00Z')
+        result = SsrStore.as_of(df, ['2024-01-01', '2300-01-01'])
+        self.assertEqual(len(result), 2)
+        result = SsrStore.as_of(df, ('2024-01-01', '2300-01-01'))
+        self.assertEqual(result['valid_to'].tolist(), [pd.Timestamp('2300-01-01')])
+
+    def test_empty_register(self):
+        result = SsrStore.as_of(pd.DataFrame(), '2024-01-01')
+        self.assertTrue(result.empty)
+        self.assertIn('as_of_date', result.columns)
+
+    def test_date_range_without_valid_records(self):
+        result = SsrStore.as_of(ssr_records(), ('1990-01-01', '1990-12-31'))
+        self.assertTrue(result.empty)
+        self.assertEqual(list(result.columns), list(ssr_records().columns) + ['valid_from', 'valid_to'])
+
+
+class SsrStoreTests(TemporaryHomeTestCase):
+
+    def test_merge_upserts_on_id(self):
+        store = SsrStore()
+        stored_df = store.merge(store.load(), ssr_records())
+        modified = ssr_records().iloc[[0]].assign(shs_modificationBDate='2024-04-01', shs_modificationDateStr='2024-03-20')
+
+        merged_df = store.merge(stored_df, modified)
+        self.assertEqual(len(merged_df), len(ssr_records()))
+        self.assertEqual(merged_df.set_index('id').loc['a1', 'shs_modificationBDate'], '2024-04-01')
+        pd.testing.assert_frame_equal(store.load(), merged_df)
+        self.assertEqual(store.last_modification_dates(merged_df), {'DE': '2024-05-02', 'FR': '2024-03-20'})
+
+    def test_watermark_capped_at_sync_date(self):
+        records = ssr_records().assign(shs_modificationDateStr=lambda x: x.shs_modificationDateStr.where(x.id != 'a1', '2027-03-01'))
+        self.assertEqual(SsrStore().last_modification_dates(records, sync_date='2026-10-19'),
+                         {'DE': '2024-05-02', 'FR': '2026-10-19'})
+
+    def test_merge_replaces_countries(self):
+        store = SsrStore()
+        stored_df = store.merge(store.load(), ssr_records())
+        merged_df = store.merge(stored_df, ssr_records().iloc[[0]], replace_countries=['FR'])
+        self.assertEqual(sorted(merged_df['id']), ['a1', 'b1', 'b2', 'd1'])
+
+    @staticmethod
+    def register_get(records, responses):
+        """Mocked requests.get answering like the register for the given records and status codes."""
+
+        def get(url):
+            country = url.split('shs_countryCode:')[1][:2]
+            response = mock.Mock()
+            response.status_code = responses.get(country, 200)
+            docs = records[records.shs_countryCode == country]
+            if 'shs_modificationDateStr' in url:
+                since = url.split('%22')[1]
+                docs = docs[docs.shs_modificationDateStr >= since]
+            response.json.return_value = {'response': {'numFound': len(docs),
+                                                       'docs': [] if 'rows=0&' in url else docs.to_dict('records')}}
+            return response
+
+        return get
+
+    @staticmethod
+    def country_urls(get_mock, country):
+        return [call.args[0] for call in get_mock.call_args_list
+                if f'shs_countryCode:{country}' in call.args[0] and 'rows=0&' not in call.args[0]]
+
+    def test_failed_country_is_requested_again(self):
+        records = ssr_records()
+        responses = {'FR': 500}
+
+        with mock.patch('esma_data_py.src.esma_data_loader.requests.get',
+                        side_effect=self.register_get(records, responses)) as get_mock:
+            first = EsmaDataLoader().sync_ssr_exempted_shares()
+            self.assertEqual(sorted(first['shs_countryCode'].unique()), ['DE'])
+
+            responses['FR'] = 200
+            second = EsmaDataLoader().sync_ssr_exempted_shares()
+            self.assertEqual(sorted(second['id']), sorted(records['id']))
+
+            self.assertNotIn('shs_modificationDateStr', self.country_urls(get_mock, 'FR')[-1])
+            self.assertIn('2024-05-02', self.country_urls(get_mock, 'DE')[-1])
+
+    def test_failed_country_kept_on_full_refresh(self):
+        records = ssr_records()
+
+        with mock.patch('esma_data_py.src.esma_data_loader.requests.get',
+                        side_effect=self.register_get(records, {})):
+            EsmaDataLoader().sync_ssr_exempted_shares()
+
+        with mock.patch('esma_data_py.src.esma_data_loader.requests.get',
+                        side_effect=self.register_get(records[records.id != 'b1'], {'FR': 500})):
+            refreshed = EsmaDataLoader().sync_ssr_exempted_shares(update=True)
+
+        self.assertEqual(sorted(refreshed['id']), ['a1', 'a2', 'b2', 'c1', 'd1', 'e1'])
+        pd.testing.assert_frame_equal(SsrStore().load(), refreshed)
+
+    def test_future_modification_does_not_hide_new_records(self):
+        records = ssr_records().assign(shs_modificationDateStr=lambda x: x.shs_modificationDateStr.where(x.id != 'a1', '2999-03-01'))
+
+        with mock.patch('esma_data_py.src.esma_data_loader.requests.get',
+                        side_effect=self.register_get(records[records.id != 'e1'], {})):
+            EsmaDataLoader().sync_ssr_exempted_shares()
+
+        # e1 is published after the first sync with a modification date before a1's
+        published = records.assign(shs_modificationDateStr=lambda x: x.shs_modificationDateStr.where(x.id != 'e1', datetime.today().strftime('%Y-%m-%d')))
+        with mock.patch('esma_data_py.src.esma_data_loader.requests.get',
+                        side_effect=self.register_get(published, {})) as get_mock:
+            synced = EsmaDataLoader().sync_ssr_exempted_shares()
+
+        self.assertIn('e1', synced['id'].tolist())
+        self.assertIn(datetime.today().strftime('%Y-%m-%d'), self.country_urls(get_mock, 'FR')[0])
+
+    def test_withdrawn_record_is_removed(self):
+        records = ssr_records()
+
+        with mock.patch('esma_data_py.src.esma_data_loader.requests.get',
+                        side_effect=self.register_get(records, {})):
+            EsmaDataLoader().sync_ssr_exempted_shares()
+
+        with mock.patch('esma_data_py.src.esma_data_loader.requests.get',
+                        side_effect=self.register_get(records[records.id != 'c1'], {})) as get_mock:
+            synced = EsmaDataLoader().sync_ssr_exempted_shares()
+
+        self.assertNotIn('c1', synced['id'].tolist())
+        self.assertEqual(sorted(synced['id']), ['a1', 'a2', 'b1', 'b2', 'd1', 'e1'])
+        # DE counts match, so it is not requested in full again
+        self.assertEqual(len(self.country_urls(get_mock, 'DE')), 1)
+        self.assertNotIn('shs_modificationDateStr', self.country_urls(get_mock, 'FR')[-1])
+
+    def test_truncated_response_is_not_stored(self):
+
+        def get(url):
+            response = mock.Mock()
+            response.status_code = 200
+            docs = ssr_records().iloc[:1].to_dict('records') if 'shs_countryCode:FR' in url else []
+            response.json.return_value = {'response': {'numFound': 2 if docs else 0, 'docs': docs}}
+            return response
+
+        with mock.patch('esma_data_py.src.esma_data_loader.requests.get', side_effect=get):
+            result = EsmaDataLoader().sync_ssr_exempted_shares()
+
+        self.assertTrue(result.empty)
+        self.assertTrue(SsrStore().load().empty)
+
+
+if __name__ == '__main__':
+    unittest.main()